@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+Compare full-document coreference resolution with the windowed mode on a long text: time per run, and agreement of
+the coreference links with the full-document clusters (precision, recall and F1 over pairs of coreferent mentions).
+
+    python benchmarks/coref_window.py [file] [--model en_core_web_sm] [--windows 3 5 10 20] [--overlap 2]
+
+Without a file, a long text is built by repeating a short report.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import argparse
+import itertools
+import time
+from typing import Set, Tuple
+
+from spacyjsonnlp import SpacyPipeline
+
+REPORT = "The Mueller Report is a very long report. We spent a long time analyzing it. " \
+         "Trump wishes we didn't, but that didn't stop the intrepid NlpLab. " \
+         "The lab published its findings, and they were read by many people. " \
+         "Its director said she was proud of the team. "
+
+
+def links(j) -> Set[Tuple[Tuple[int, ...], Tuple[int, ...]]]:
+    """All pairs of coreferent mentions in a JSON-NLP object"""
+    pairs = set()
+    for r in j['documents'][0].get('coreferences', []):
+        mentions = [tuple(r['representative']['tokens'])] + [tuple(m['tokens']) for m in r['referents']]
+        pairs.update(tuple(sorted(p)) for p in itertools.combinations(mentions, 2))
+    return pairs
+
+
+def run(text: str, model: str, window: int, overlap: int):
+    start = time.perf_counter()
+    j = SpacyPipeline.process(text, spacy_model=model, coreferences=True, dependencies=True, expressions=False,
+                              coref_window=window, coref_overlap=overlap)
+    return time.perf_counter() - start, links(j)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark windowed coreference resolution')
+    parser.add_argument('file', nargs='?', help='text file to process')
+    parser.add_argument('--model', default='en_core_web_sm')
+    parser.add_argument('--windows', type=int, nargs='+', default=[3, 5, 10, 20])
+    parser.add_argument('--overlap', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=40, help='copies of the built-in report without a file')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = REPORT * args.repeat
+
+    run(text[:1000], args.model, 0, args.overlap)  # load the models outside the measurements
+    run(text[:1000], args.model, args.windows[0], args.overlap)
+
+    full_seconds, full_links = run(text, args.model, 0, args.overlap)
+    print(f'{len(text)} characters, {len(full_links)} coreference links in full-document mode')
+    print(f'{"window":>8} {"seconds":>9} {"speedup":>8} {"precision":>10} {"recall":>8} {"F1":>6}')
+    print(f'{"full":>8} {full_seconds:9.2f} {1:8.2f} {1:10.3f} {1:8.3f} {1:6.3f}')
+    for window in args.windows:
+        seconds, found = run(text, args.model, window, args.overlap)
+        common = len(found & full_links)
+        precision = common / len(found) if found else 0.0
+        recall = common / len(full_links) if full_links else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        print(f'{window:>8} {seconds:9.2f} {full_seconds / seconds:8.2f} {precision:10.3f} {recall:8.3f} {f1:6.3f}')
+
+
+if __name__ == "__main__":
+    main()
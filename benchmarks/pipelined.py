@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+Compare pipelined batch processing, with tokenization, inference and JSON-NLP building in their own threads, with
+SpacyPipeline.process_batch on the same texts: time per run and documents per second, with and without serializing
+the results to JSON. The stages share the GIL, so any speedup comes from the parts of the model that release it.
+
+    python benchmarks/pipelined.py [file] [--model en_core_web_sm] [--batch-size 8] [--queue-size 8] [--runs 3]
+
+The file holds one document per line. Without a file, documents are built by repeating a short report.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from spacyjsonnlp import SpacyPipeline
+from spacyjsonnlp.pipelining import pipelined
+
+REPORT = "The Mueller Report is a very long report. We spent a long time analyzing it. " \
+         "Trump wishes we didn't, but that didn't stop the intrepid NlpLab. " \
+         "The lab published its findings, and they were read by many people. "
+
+
+def best_of(runs: int, func: Callable[[], list]) -> float:
+    """The fastest of runs calls of func, in seconds"""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipelined batch processing')
+    parser.add_argument('file', nargs='?', help='text file with one document per line')
+    parser.add_argument('--model', default='en_core_web_sm')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=3, help='the best of this many runs is reported')
+    parser.add_argument('--documents', type=int, default=200, help='documents to build without a file')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            texts: List[str] = [line.strip() for line in f if line.strip()]
+    else:
+        texts = [REPORT * (1 + i % 5) for i in range(args.documents)]
+    options = dict(spacy_model=args.model, coreferences=False, constituents=False)
+
+    SpacyPipeline.process_batch(texts[:2], **options)  # load the model outside the measurements
+
+    runs = [
+        ('process_batch', lambda: SpacyPipeline.process_batch(texts, batch_size=args.batch_size, **options)),
+        ('pipelined', lambda: list(pipelined(texts, batch_size=args.batch_size, queue_size=args.queue_size,
+                                             **options))),
+        ('process_batch + json', lambda: [json.dumps(j) for j in
+                                          SpacyPipeline.process_batch(texts, batch_size=args.batch_size, **options)]),
+        ('pipelined + json', lambda: list(pipelined(texts, batch_size=args.batch_size, queue_size=args.queue_size,
+                                                    serialize=True, **options))),
+    ]
+    print(f'{len(texts)} documents, {sum(len(t) for t in texts)} characters, best of {args.runs} runs')
+    print(f'{"mode":>22} {"seconds":>9} {"docs/s":>8} {"speedup":>8}')
+    baseline = None
+    for name, func in runs:
+        seconds = best_of(args.runs, func)
+        if name.startswith('process_batch'):
+            baseline = seconds
+        print(f'{name:>22} {seconds:9.2f} {len(texts) / seconds:8.1f} {baseline / seconds:8.2f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -12,11 +12,13 @@ Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
 """
 
 import functools
+import os
 import re
+import threading
 from collections import OrderedDict, defaultdict, Counter
-from typing import Dict, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
-import neuralcoref
+from neuralcoref import NeuralCoref
 import spacy
 from benepar.spacy_plugin import BeneparComponent
 from pyjsonnlp import get_base, get_base_document, remove_empty_fields, build_constituents, find_head, build_coreference
@@ -24,6 +26,7 @@ from pyjsonnlp.pipeline import Pipeline
 from pyjsonnlp.tokenization import segment
 from spacy.language import Language
 from spacy.tokens import Doc
+from spacyjsonnlp.sentence_cache import SentenceCache
 #from spacyjsonnlp.dependencies import DependencyAnnotator
 #from dependencies import DependencyAnnotator
 
@@ -31,46 +34,290 @@ name = "spacypyjsonnlp"
 __version__ = '0.1.3'
 
 # allowed model names
-MODEL_NAMES = ('en_core_web_sm', 'en_core_web_md', 'en_core_web_lg' 'xx_ent_wiki_sm', 'de_core_news_sm', 'es_core_news_sm',
+MODEL_NAMES = ('en_core_web_sm', 'en_core_web_md', 'en_core_web_lg', 'xx_ent_wiki_sm', 'de_core_news_sm', 'es_core_news_sm',
                'pt_core_news_sm', 'fr_core_news_sm', 'it_core_news_sm', 'nl_core_news_sm')
 CONSTITUENTS = {'en': 'benepar_en2', 'de': 'benepar_de'}
 COREF = {'en_core_web_sm', 'en_core_web_md', 'en_core_web_lg', 'xx_ent_wiki_sm'}
+COREF_MAX_DIST = 500  # upper bound for the mentions between a mention and its antecedent in windowed coref
 WORD_REGEX = re.compile(r'^[A-Za-z]+$')
 
+# models used when routing by detected language, anything we cannot place goes to the multi-language model
+LANGUAGE_MODELS = {'en': 'en_core_web_sm', 'de': 'de_core_news_sm', 'es': 'es_core_news_sm', 'pt': 'pt_core_news_sm',
+                   'fr': 'fr_core_news_sm', 'it': 'it_core_news_sm', 'nl': 'nl_core_news_sm'}
+FALLBACK_MODEL = 'xx_ent_wiki_sm'
+# high-frequency function words, enough for a cheap vote over the start of a document
+LANGUAGE_PROFILES = {
+    'en': frozenset('the of and to in is that it was for on are with as be at by this have from not a i you he she we they my am'.split()),
+    'de': frozenset('der die das und ist nicht ich zu den von mit sich des auf für ein eine dem im auch am'.split()),
+    'es': frozenset('el la de que y en los se del las un por con no una su para es al lo como a'.split()),
+    'pt': frozenset('o a de que e do da em um para é com não uma os no se na por mais as dos'.split()),
+    'fr': frozenset('le la de et les des un une du est en que qui dans pour pas sur au il ne'.split()),
+    'it': frozenset('il la di che e un una è per non sono del della in con si da le gli a i come ma ho'.split()),
+    'nl': frozenset('de het een en van is dat niet ik te op in zijn met voor er aan ook'.split()),
+}
+# a word found in n profiles counts 1/n towards each of their languages
+LANGUAGE_WEIGHTS = dict((word, 1 / sum(word in words for words in LANGUAGE_PROFILES.values()))
+                        for words in LANGUAGE_PROFILES.values() for word in words)
+# optional token attributes, 'offsets' covers both character offsets
+TOKEN_FIELDS = ('lemma', 'xpos', 'upos', 'entity_iob', 'offsets', 'lang', 'features', 'misc', 'shape', 'entity')
+FIELD_PROFILES = {
+    'full': frozenset(TOKEN_FIELDS),
+    'text': frozenset(),
+    'pos': frozenset(('lemma', 'xpos', 'upos')),
+    'entities': frozenset(('entity_iob', 'entity', 'offsets')),
+}
+DETECTION_CHARS = 1000  # how much of the text to look at
+DETECTION_MIN_SCORE = 1.0  # a lower weighted vote than this and we fall back
+DETECTION_REGEX = re.compile(r'\w+')
+
 __cache = defaultdict(dict)
+__cache_lock = threading.Lock()  # held for changes to the cache and snapshots of it, never while loading
+__loading: Dict[tuple, threading.Lock] = {}  # one lock per function and params, held while loading
+__resets = [0]  # bumped by reset_model, so a load that started before a reset is not cached
+__strings: Dict[str, int] = {}  # size of the StringStore of each model when loaded
 
 
 def cache_it(func):
     """A decorator to cache function response based on params. Add it to top of function as @cache_it."""
 
     global __cache
+    cache = __cache[func.__name__]
 
     @functools.wraps(func)
     def cached(*args):
-        f_name = func.__name__
-        s = ''.join(map(str, args))
-        if s not in __cache[f_name]:
-            __cache[f_name][s] = func(*args)
-        return __cache[f_name][s]
+        try:
+            return cache[args]
+        except KeyError:
+            pass
+        with __cache_lock:
+            loading = __loading.setdefault((func.__name__, args), threading.Lock())
+        # only callers of the same function with the same params wait for each other
+        with loading:
+            try:
+                return cache[args]
+            except KeyError:
+                pass
+            resets = __resets[0]
+            value = func(*args)
+            with __cache_lock:
+                if resets == __resets[0]:
+                    cache[args] = value
+            return value
     return cached
 
 
-@cache_it
-def get_model(spacy_model: str, coref: bool, constituents: bool) -> Language:
+def resolve_model(spacy_model: str) -> str:
+    """Map a model alias to its name, and make sure we know about it"""
     if spacy_model == 'en':
         spacy_model = 'en_core_web_sm'
     if spacy_model not in MODEL_NAMES:
         raise ModuleNotFoundError(f'No such spaCy model "{spacy_model}"')
+    return spacy_model
+
+
+@cache_it
+def get_base_model(spacy_model: str) -> Language:
+    """Load a model once, its variants from get_model share its vocab, vectors and pipes"""
     nlp = spacy.load(spacy_model)
+    if 'parser' not in nlp.pipe_names:
+        # build_json needs sentences, models like xx_ent_wiki_sm only have ner
+        nlp.add_pipe(nlp.create_pipe('sentencizer'), first=True)
+    __strings[spacy_model] = len(nlp.vocab.strings)
+    return nlp
+
+
+@cache_it
+def get_model(spacy_model: str, coref: bool, constituents: bool) -> Language:
+    spacy_model = resolve_model(spacy_model)
+    base = get_base_model(spacy_model)
+    if not (coref and spacy_model in COREF) and not (constituents and spacy_model[:2] in CONSTITUENTS):
+        return base
+    nlp = base.__class__(vocab=base.vocab, meta=base.meta)
+    for pipe_name, proc in base.pipeline:
+        nlp.add_pipe(proc, name=pipe_name)
     if coref and spacy_model in COREF:
-        neuralcoref.add_to_pipe(nlp)
+        nlp.add_pipe(get_coref(spacy_model), name='neuralcoref')
     if constituents:
         model = CONSTITUENTS.get(spacy_model[:2], "")
         if model:
-            nlp.add_pipe(BeneparComponent(model))
+            nlp.add_pipe(get_constituency_parser(model))
+    return nlp
+
+
+@cache_it
+def get_coref(spacy_model: str) -> NeuralCoref:
+    """A neuralcoref component for the vocab of a model, other settings are passed when calling it"""
+    return NeuralCoref(get_base_model(resolve_model(spacy_model)).vocab)
+
+
+@cache_it
+def get_constituency_parser(model: str) -> BeneparComponent:
+    return BeneparComponent(model)
+
+
+def weights_size(proc) -> Optional[int]:
+    """Bytes taken by the weights of a pipeline component, None if we cannot tell"""
+    try:
+        return sum(node._mem.weights.nbytes for node in proc.model.walk() if hasattr(node, '_mem'))
+    except Exception:
+        return None
+
+
+def resident_memory() -> Optional[int]:
+    """Resident memory of this process in bytes, None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, IOError, IndexError, ValueError):
+        return None
+
+
+def model_memory_report() -> OrderedDict:
+    """
+    Report the memory of the loaded models: the process' resident memory, and per model the size of its vectors,
+    of the weights of its pipes (including the coref and constituency pipes of its variants), and the number of
+    strings in its StringStore with their growth since loading.
+    """
+    report = OrderedDict()
+    report['residentMemory'] = resident_memory()
+    report['models'] = OrderedDict()
+    with __cache_lock:
+        bases = list(__cache['get_base_model'].items())
+        models = list(__cache['get_model'].values())
+    for (spacy_model,), base in bases:
+        variants = [nlp for nlp in models if nlp.vocab is base.vocab]
+        pipes = OrderedDict()
+        for nlp in variants:
+            for pipe_name, proc in nlp.pipeline:
+                pipes.setdefault(pipe_name, weights_size(proc))
+        report['models'][spacy_model] = {
+            'vectors': base.vocab.vectors.data.nbytes,
+            'weights': pipes,
+            'variants': len(variants),
+            'lexemes': len(base.vocab),
+            'strings': len(base.vocab.strings),
+            'stringGrowth': len(base.vocab.strings) - __strings[spacy_model],
+        }
+    return report
+
+
+def reset_model(spacy_model: str) -> None:
+    """
+    Drop a model and its variants, so the next request loads them again with a fresh vocab and StringStore.
+    Requests that are still running keep the model they started with.
+    """
+    spacy_model = resolve_model(spacy_model)
+    with __cache_lock:
+        __resets[0] += 1
+        __cache['get_base_model'].pop((spacy_model,), None)
+        for f_name in ('get_model', 'get_coref'):
+            for key in [key for key in __cache[f_name] if resolve_model(key[0]) == spacy_model]:
+                del __cache[f_name][key]
+
+
+def reset_grown_models(max_growth: int) -> List[str]:
+    """Reset the models whose StringStore grew by more than max_growth strings, returns their names"""
+    with __cache_lock:
+        bases = list(__cache['get_base_model'].items())
+    grown = [spacy_model for (spacy_model,), nlp in bases if len(nlp.vocab.strings) - __strings[spacy_model] > max_growth]
+    for spacy_model in grown:
+        reset_model(spacy_model)
+    return grown
+
+
+def windowed_coref(doc: Doc, spacy_model: str, window: int, overlap=2, max_dist=50) -> List[Tuple[List[int], List[List[int]]]]:
+    """
+    Resolve coreferences within windows of window sentences that share overlap sentences with the next window, and
+    at most max_dist mentions between a mention and its antecedent. Clusters that share a mention across windows are
+    merged, the representative comes from the earliest window. Returns (main, mentions) lists of doc token indices.
+    """
+    window, overlap = int(window), int(overlap)
+    max_dist = min(max(1, int(max_dist)), COREF_MAX_DIST)
+    if resolve_model(spacy_model) not in COREF:
+        return []
+    coref = get_coref(resolve_model(spacy_model))
+    sents = list(doc.sents)
+    step = max(1, window - overlap)
+    parent: Dict[Tuple[int, int], Tuple[int, int]] = {}  # union-find over (start, end) mentions
+    mains: List[Tuple[int, Tuple[int, int]]] = []  # (window number, main mention) per window cluster
+
+    def find(m):
+        while parent[m] != m:
+            parent[m] = parent[parent[m]]
+            m = parent[m]
+        return m
+
+    for w, first in enumerate(range(0, len(sents), step)):
+        span = doc[sents[first].start:sents[min(first + window, len(sents)) - 1].end]
+        # noinspection PyProtectedMember
+        for cluster in coref(span.as_doc(), max_dist=max_dist)._.coref_clusters or []:
+            mentions = [(m.start + span.start, m.end + span.start) for m in cluster.mentions]
+            for m in mentions:
+                parent.setdefault(m, m)
+            for m in mentions[1:]:
+                parent[find(m)] = find(mentions[0])
+            mains.append((w, (cluster.main.start + span.start, cluster.main.end + span.start)))
+        if first + window >= len(sents):
+            break
+
+    merged: Dict[Tuple[int, int], List[Tuple[int, int]]] = defaultdict(list)
+    for m in sorted(parent):
+        merged[find(m)].append(m)
+    representatives: Dict[Tuple[int, int], Tuple[int, int]] = {}
+    for w, main in sorted(mains):
+        representatives.setdefault(find(main), main)
+    return [(list(range(*representatives[root])), [list(range(*m)) for m in mentions])
+            for root, mentions in sorted(merged.items(), key=lambda kv: kv[1][0])]
+
+
+def load_model(spacy_model: str, coref: bool, constituents: bool) -> Language:
+    """Get a cached model, set up with our tokenizer"""
+    nlp = get_model(spacy_model, coref, constituents)
+    nlp.tokenizer = SyntokTokenizer(nlp.vocab)
     return nlp
 
 
+def resolve_fields(fields=None) -> frozenset:
+    """
+    Turn a field projection into the set of optional token fields to build.
+    fields can be None (everything), a profile name from FIELD_PROFILES, a comma separated string, or a list of
+    names from TOKEN_FIELDS. The id, sentence_id and text of a token are always included.
+    """
+    if fields is None:
+        return FIELD_PROFILES['full']
+    if isinstance(fields, str):
+        if fields in FIELD_PROFILES:
+            return FIELD_PROFILES[fields]
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    fields = frozenset(fields) - {'id', 'sentence_id', 'text'}
+    unknown = fields - FIELD_PROFILES['full']
+    if unknown:
+        raise ValueError(f'Unknown token fields: {", ".join(sorted(unknown))}')
+    return fields
+
+
+def detect_language(text: str) -> str:
+    """
+    Guess the language of text by voting with function words, weighted by how few languages share each word.
+    Returns 'xx' if there is no clear answer.
+    """
+    votes = Counter()
+    for word in DETECTION_REGEX.findall(text[:DETECTION_CHARS].lower()):
+        if word in LANGUAGE_WEIGHTS:
+            for language, words in LANGUAGE_PROFILES.items():
+                if word in words:
+                    votes[language] += LANGUAGE_WEIGHTS[word]
+    ranked = votes.most_common(2)
+    if not ranked or ranked[0][1] < DETECTION_MIN_SCORE or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+        return 'xx'
+    return ranked[0][0]
+
+
+def route_model(text: str) -> str:
+    """Pick the model for the detected language of text"""
+    return LANGUAGE_MODELS.get(detect_language(text), FALLBACK_MODEL)
+
+
 class SyntokTokenizer(object):
     def __init__(self, vocab):
         self.vocab = vocab
@@ -85,157 +332,296 @@ class SyntokTokenizer(object):
         return Doc(self.vocab, words=words, spaces=spaces)
 
 
-class SpacyPipeline(Pipeline):
-    @staticmethod
-    def process(text: str = '', spacy_model='en_core_web_sm', coreferences=False, constituents=False, dependencies=True, expressions=True) -> OrderedDict:
-        """Process provided text"""
-        nlp = get_model(spacy_model, coreferences, constituents)
-        nlp.tokenizer = SyntokTokenizer(nlp.vocab)
-        doc = nlp(text)
-        j: OrderedDict = get_base()
-        d: OrderedDict = get_base_document(1)
-        j['documents'].append(d)
-
-        d['meta']['DC.source'] = 'SpaCy {}'.format(spacy.__version__)
-        d['text'] = text
-
-        model_lang = spacy_model[0:2]
-        lang = Counter()  # track the frequency of each language
-        sent_lookup: Dict[int, int] = {}  # map sentence end_char to our index
-        token_lookup: Dict[Tuple[int, int], int] = {}  # map (sent_id, spacy token index) to our token index
-    
-        # tokens and sentences
-        token_id = 1
-        sent_num = 1
-        for sent in doc.sents:
-            
-            current_sent = {
-                'id': sent_num,
-                'tokenFrom': token_id,
-                'tokenTo': token_id + len(sent),  # begin inclusive, end exclusive
-                'tokens': []
+def build_json(text: str, doc: Doc, nlp: Language, spacy_model: str, coreferences=False, constituents=False,
+               dependencies=True, expressions=True, fields=None, coref_clusters=None) -> OrderedDict:
+    """
+    Build the JSON-NLP output for a document processed by nlp, with only the requested token fields.
+    coref_clusters replaces the neuralcoref clusters of doc, as (main, mentions) lists of token indices.
+    """
+    fields = resolve_fields(fields)
+    j: OrderedDict = get_base()
+    d: OrderedDict = get_base_document(1)
+    j['documents'].append(d)
+
+    d['meta']['DC.source'] = 'SpaCy {}'.format(spacy.__version__)
+    d['text'] = text
+
+    model_lang = spacy_model[0:2]
+    lang = Counter()  # track the frequency of each language
+    sent_lookup: Dict[int, int] = {}  # map sentence end_char to our index
+    token_lookup: Dict[Tuple[int, int], int] = {}  # map (sent_id, spacy token index) to our token index
+
+    # tokens and sentences
+    token_id = 1
+    sent_num = 1
+    for sent in doc.sents:
+        
+        current_sent = {
+            'id': sent_num,
+            'tokenFrom': token_id,
+            'tokenTo': token_id + len(sent),  # begin inclusive, end exclusive
+            'tokens': []
+        }
+        if constituents:
+            try:
+                d['constituents'].append(build_constituents(sent_num, sent._.parse_string))
+            except Exception:
+                pass
+
+        sent_lookup[sent.end_char] = sent_num
+        d['sentences'][current_sent['id']] =  current_sent
+        #d['sentences'].append(current_sent)
+        last_char_index = 0
+        for token in sent:
+            t = {
+                'id': token_id,
+                'sentence_id': sent_num,
+                'text': token.text,
             }
-            if constituents:
-                try:
-                    d['constituents'].append(build_constituents(sent_num, sent._.parse_string))
-                except Exception:
-                    pass
-
-            sent_lookup[sent.end_char] = sent_num
-            d['sentences'][current_sent['id']] =  current_sent
-            #d['sentences'].append(current_sent)
-            last_char_index = 0
-            for token in sent:
-                t = {
-                    'id': token_id,
-                    'sentence_id': sent_num,
-                    'text': token.text,
-                    'lemma': token.lemma_,
-                    'xpos': token.tag_,
-                    'upos': token.pos_,
-                    'entity_iob': token.ent_iob_,
-                    'characterOffsetBegin': token.idx,
-                    'characterOffsetEnd': token.idx + len(token),
-                    'lang': token.lang_,
-                    'features': {
-                        'Overt': True,
-                        'Stop': True if token.is_stop else False,
-                        'Alpha': True if token.is_alpha else False,
-                    },
-                    'misc': {
-                        'SpaceAfter': False
-                    }
+            if 'lemma' in fields:
+                t['lemma'] = token.lemma_
+            if 'xpos' in fields:
+                t['xpos'] = token.tag_
+            if 'upos' in fields:
+                t['upos'] = token.pos_
+            if 'entity_iob' in fields:
+                t['entity_iob'] = token.ent_iob_
+            if 'offsets' in fields:
+                t['characterOffsetBegin'] = token.idx
+                t['characterOffsetEnd'] = token.idx + len(token)
+            if 'lang' in fields:
+                t['lang'] = token.lang_
+            if 'features' in fields:
+                t['features'] = {
+                    'Overt': True,
+                    'Stop': True if token.is_stop else False,
+                    'Alpha': True if token.is_alpha else False,
+                }
+            if 'misc' in fields:
+                t['misc'] = {
+                    'SpaceAfter': False
                 }
 
-                # shape
-                if WORD_REGEX.findall(token.text):
-                    t['shape'] = token.shape_
+            # shape
+            if 'shape' in fields and WORD_REGEX.findall(token.text):
+                t['shape'] = token.shape_
 
-                # space after?
+            # space after?
+            if 'misc' in fields:
                 if token.idx != 0 and token.idx != last_char_index:
                     # we don't know there was a space after the previous token until we see where this one
                     # starts in relation to where the last one finished
                     d['tokenList'][token_id-2]['misc']['SpaceAfter'] = True
-                last_char_index = t['characterOffsetEnd']
+                last_char_index = token.idx + len(token)
 
+            if 'features' in fields:
                 # morphology
                 for i, kv in enumerate(nlp.vocab.morphology.tag_map.get(token.tag_, {}).items()):
                     if i > 0:  # numeric k/v pair at the beginning
                         t['features'][kv[0]] = str(kv[1]).title()
 
-                # entities
-                if token.ent_type_:
-                    t['entity'] = token.ent_type_
+            # entities
+            if 'entity' in fields and token.ent_type_:
+                t['entity'] = token.ent_type_
 
-                # maybe check if a non-model language
-                if model_lang != 'xx':
-                    t['features']['Foreign'] = False if model_lang == token.lang_ else True
+            # maybe check if a non-model language
+            if 'features' in fields and model_lang != 'xx':
+                t['features']['Foreign'] = False if model_lang == token.lang_ else True
 
-                # bookkeeping
-                lang[token.lang_] += 1
-                token_lookup[(sent_num, token.i)] = token_id
-                current_sent['tokens'].append(token_id)
-                d['tokenList'].append(t)
-                token_id += 1
+            # bookkeeping
+            lang[token.lang_] += 1
+            token_lookup[(sent_num, token.i)] = token_id
+            current_sent['tokens'].append(token_id)
+            d['tokenList'].append(t)
+            token_id += 1
 
+        if 'misc' in fields:
             d['tokenList'][token_id-2]['misc']['SpaceAfter'] = True  # EOS tokens have spaces after them
-            sent_num += 1
+        sent_num += 1
 
+    if 'misc' in fields:
         d['tokenList'][token_id-2]['misc']['SpaceAfter'] = False  # EOD tokens do not
 
-        # noun phrases
-        if expressions:
-            chunk_id = 1
-            for chunk in doc.noun_chunks:
-                if len(chunk) > 1:
-                    sent_id = sent_lookup[chunk.sent.sent.end_char]
-                    d['expressions'].append({
-                        'id': chunk_id,
-                        'type': 'NP',
-                        'head': token_lookup[(sent_id, chunk.root.i)],
-                        'dependency': chunk.root.dep_.lower(),
-                        'tokens': [token_lookup[(sent_id, token.i)] for token in chunk]
-                    })
-                    chunk_id += 1
-
-        # dependencies
-        if dependencies:
-            d['dependencies']=[]
-            for sent_num, sent in enumerate(doc.sents):
-                deps = {
-                'style': "universal",
-                'trees':[]
-                }
-                for token in sent:
-                    dependent = token_lookup[(sent_num+1, token.i)]
-                    deps['trees'].append({   
-                        #'sentenceId': sent_num+1,
-                        'lab': token.dep_ if token.dep_ != 'ROOT' else 'root',
-                        'gov': token_lookup[(sent_num+1, token.head.i)] if token.dep_ != 'ROOT' else 0,
-                        'dep': dependent
-                    })
-                d['dependencies'].append(deps)
-
-        # coref
+    # noun phrases, they need a parse
+    if expressions and doc.is_parsed:
+        chunk_id = 1
+        for chunk in doc.noun_chunks:
+            if len(chunk) > 1:
+                sent_id = sent_lookup[chunk.sent.sent.end_char]
+                d['expressions'].append({
+                    'id': chunk_id,
+                    'type': 'NP',
+                    'head': token_lookup[(sent_id, chunk.root.i)],
+                    'dependency': chunk.root.dep_.lower(),
+                    'tokens': [token_lookup[(sent_id, token.i)] for token in chunk]
+                })
+                chunk_id += 1
+
+    # dependencies
+    if dependencies and doc.is_parsed:
+        d['dependencies']=[]
+        for sent_num, sent in enumerate(doc.sents):
+            deps = {
+            'style': "universal",
+            'trees':[]
+            }
+            for token in sent:
+                dependent = token_lookup[(sent_num+1, token.i)]
+                deps['trees'].append({   
+                    #'sentenceId': sent_num+1,
+                    'lab': token.dep_ if token.dep_ != 'ROOT' else 'root',
+                    'gov': token_lookup[(sent_num+1, token.head.i)] if token.dep_ != 'ROOT' else 0,
+                    'dep': dependent
+                })
+            d['dependencies'].append(deps)
+
+    # coref
+    if coreferences and coref_clusters is None:
         # noinspection PyProtectedMember
-        if coreferences and doc._.coref_clusters is not None:
-            # noinspection PyProtectedMember
-            for cluster in doc._.coref_clusters:
-                    r = build_coreference(cluster.i)
-                    r['representative']['tokens'] = [t.i+1 for t in cluster.main]
-                    r['representative']['head'] = find_head(d, r['representative']['tokens'], d['tokenList'][max(r['representative']['tokens'])]['sentence_id'], 'universal')
-                    for m in cluster.mentions:
-                        if m[0].i+1 in r['representative']['tokens']:
-                            continue  # don't include the representative in the mention list
-                        ref = {'tokens': [t.i+1 for t in m]}
-                        ref['head'] = find_head(d, ref['tokens'], sent_num+1, 'universal')
-                        r['referents'].append(ref)
-                    d['coreferences'].append(r)
-
-        d['meta']['DC.language'] = max(lang)
-
-        return remove_empty_fields(j)
-        #return j
+        clusters = getattr(doc._, 'coref_clusters', None) or []
+        coref_clusters = [([t.i for t in c.main], [[t.i for t in m] for m in c.mentions]) for c in clusters]
+    if coreferences:
+        for cluster_id, (main, mentions) in enumerate(coref_clusters):
+            r = build_coreference(cluster_id)
+            r['representative']['tokens'] = [i+1 for i in main]
+            r['representative']['head'] = find_head(d, r['representative']['tokens'], d['tokenList'][max(r['representative']['tokens'])]['sentence_id'], 'universal')
+            for m in mentions:
+                if m[0]+1 in r['representative']['tokens']:
+                    continue  # don't include the representative in the mention list
+                ref = {'tokens': [i+1 for i in m]}
+                ref['head'] = find_head(d, ref['tokens'], sent_num+1, 'universal')
+                r['referents'].append(ref)
+            d['coreferences'].append(r)
+
+    d['meta']['DC.language'] = max(lang)
+
+    return remove_empty_fields(j)
+    #return j
+
+
+def splice_sentences(d: OrderedDict, part: OrderedDict, char_offset: int) -> None:
+    """Append the analysis of a sentence, part, to the document d, shifting its ids and character offsets"""
+    token_offset = len(d['tokenList'])
+    sent_offset = len(d['sentences'])
+    expr_offset = len(d['expressions'])
+    if d['tokenList'] and 'misc' in d['tokenList'][-1]:
+        d['tokenList'][-1]['misc']['SpaceAfter'] = True  # EOS tokens have spaces after them
+
+    for t in part['tokenList']:
+        t = dict(t, id=t['id'] + token_offset, sentence_id=t['sentence_id'] + sent_offset)
+        if 'characterOffsetBegin' in t:
+            t['characterOffsetBegin'] += char_offset
+            t['characterOffsetEnd'] += char_offset
+        if 'features' in t:
+            t['features'] = dict(t['features'])
+        if 'misc' in t:
+            t['misc'] = dict(t['misc'])
+        d['tokenList'].append(t)
+    for sent_id, sent in part['sentences'].items():
+        d['sentences'][sent_id + sent_offset] = {
+            'id': sent['id'] + sent_offset,
+            'tokenFrom': sent['tokenFrom'] + token_offset,
+            'tokenTo': sent['tokenTo'] + token_offset,
+            'tokens': [t_id + token_offset for t_id in sent['tokens']]
+        }
+    for deps in part.get('dependencies', []):
+        d['dependencies'].append({
+            'style': deps['style'],
+            'trees': [{'lab': arc['lab'], 'gov': arc['gov'] + token_offset if arc['gov'] else 0, 'dep': arc['dep'] + token_offset}
+                      for arc in deps['trees']]
+        })
+    for c in part.get('constituents', []):
+        d['constituents'].append(dict(c, sentenceId=c['sentenceId'] + sent_offset))
+    for e in part.get('expressions', []):
+        d['expressions'].append(dict(e, id=e['id'] + expr_offset, head=e['head'] + token_offset,
+                                     tokens=[t_id + token_offset for t_id in e['tokens']]))
+
+
+def build_json_cached(text: str, nlp: Language, spacy_model: str, cache: SentenceCache, constituents=False,
+                      dependencies=True, expressions=True, fields=None, batch_size=32) -> OrderedDict:
+    """
+    Build the JSON-NLP output for text sentence by sentence, taking the analysis of sentences seen before from cache.
+    Sentences are split by syntok, and only those missing from the cache are parsed, each on its own.
+    """
+    fields = resolve_fields(fields)
+    spans = [(sent[0].offset, sent[-1].offset + len(sent[-1].value)) for sent in segment(text) if sent]
+    keys = [(spacy_model, constituents, dependencies, expressions, fields, text[start:end]) for start, end in spans]
+    parts = dict((key, cache.get(key)) for key in OrderedDict.fromkeys(keys))
+    missing = [key for key, part in parts.items() if part is None]
+    for key, doc in zip(missing, nlp.pipe((key[-1] for key in missing), batch_size=batch_size)):
+        parts[key] = build_json(key[-1], doc, nlp, spacy_model, False, constituents, dependencies, expressions,
+                                fields)['documents'][0]
+        cache.put(key, parts[key], len(key[-1]))
+
+    j: OrderedDict = get_base()
+    d: OrderedDict = get_base_document(1)
+    j['documents'].append(d)
+    d['meta']['DC.source'] = 'SpaCy {}'.format(spacy.__version__)
+    d['text'] = text
+    lang = Counter()  # track the frequency of each language
+    for (start, end), key in zip(spans, keys):
+        splice_sentences(d, parts[key], start)
+        lang[parts[key]['meta']['DC.language']] += len(parts[key]['tokenList'])
+    d['meta']['DC.language'] = max(lang)
+
+    return remove_empty_fields(j)
+
+
+class SpacyPipeline(Pipeline):
+    @staticmethod
+    def process(text: str = '', spacy_model='en_core_web_sm', coreferences=False, constituents=False, dependencies=True, expressions=True,
+                fields=None, coref_window=0, coref_overlap=2, coref_max_dist=50, sentence_cache: SentenceCache = None) -> OrderedDict:
+        """
+        Process provided text, use spacy_model='auto' to pick the model from the detected language.
+        fields limits the token attributes that are built, see resolve_fields.
+        A coref_window above 0 resolves coreferences within windows of that many sentences, see windowed_coref.
+        With a sentence_cache, sentences seen before are not parsed again, see build_json_cached. The cache is not
+        used for coreferences, which need the whole document.
+        """
+        if spacy_model == 'auto':
+            spacy_model = route_model(text)
+        if sentence_cache is not None and not coreferences:
+            nlp = load_model(spacy_model, False, constituents)
+            return build_json_cached(text, nlp, spacy_model, sentence_cache, constituents, dependencies, expressions, fields)
+        windowed = coreferences and int(coref_window) > 0
+        nlp = load_model(spacy_model, coreferences and not windowed, constituents)
+        doc = nlp(text)
+        clusters = windowed_coref(doc, spacy_model, coref_window, coref_overlap, coref_max_dist) if windowed else None
+        return build_json(text, doc, nlp, spacy_model, coreferences, constituents, dependencies, expressions, fields,
+                          clusters)
+
+    @staticmethod
+    def process_batch(texts: Iterable[str], spacy_model='auto', coreferences=False, constituents=False, dependencies=True,
+                      expressions=True, fields=None, batch_size=32, coref_window=0, coref_overlap=2,
+                      coref_max_dist=50, sentence_cache: SentenceCache = None) -> List[OrderedDict]:
+        """
+        Process many texts, returning one JSON-NLP object per text in the original order.
+        With spacy_model='auto' the texts are grouped by the model of their detected language, and each group runs
+        as a single nlp.pipe batch, so no document is parsed by the wrong model and models are not swapped per text.
+        With a sentence_cache and no coreferences, each text is built with build_json_cached instead.
+        """
+        texts = list(texts)
+        fields = resolve_fields(fields)  # fail before loading any model
+        groups: Dict[str, List[int]] = OrderedDict()  # map model name to the indices of its texts
+        for i, text in enumerate(texts):
+            groups.setdefault(route_model(text) if spacy_model == 'auto' else spacy_model, []).append(i)
+
+        results: List[OrderedDict] = [None] * len(texts)
+        windowed = coreferences and int(coref_window) > 0
+        for model, indices in groups.items():
+            if sentence_cache is not None and not coreferences:
+                nlp = load_model(model, False, constituents)
+                for i in indices:
+                    results[i] = build_json_cached(texts[i], nlp, model, sentence_cache, constituents, dependencies,
+                                                   expressions, fields, batch_size)
+                continue
+            nlp = load_model(model, coreferences and not windowed, constituents)
+            docs = nlp.pipe((texts[i] for i in indices), batch_size=batch_size)
+            for i, doc in zip(indices, docs):
+                clusters = windowed_coref(doc, model, coref_window, coref_overlap, coref_max_dist) if windowed else None
+                results[i] = build_json(texts[i], doc, nlp, model, coreferences, constituents, dependencies, expressions,
+                                        fields, clusters)
+        return results
 
 
 if __name__ == "__main__":
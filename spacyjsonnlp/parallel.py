@@ -0,0 +1,120 @@
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+Multi-process batch processing. Workers write their results as encoded JSON into memory-mapped spool files and only
+send small handles back, so the parent does not unpickle and rebuild the nested JSON-NLP objects.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+from spacyjsonnlp import SpacyPipeline
+
+Handle = Tuple[str, int, int]  # spool file name, offset and length of one result
+SPOOL_SIZE = 1 << 20  # a spool file starts at this size and doubles whenever it is full
+
+
+class Spool(object):
+    """
+    A directory of append-only spool files. Each writing process appends to its own file and hands out handles,
+    the reading process maps the files into memory and returns views of the results. The files grow by doubling,
+    so a reader maps each file again only a few times, and the views of most results share one map.
+    """
+    def __init__(self, directory: str = None):
+        self.owner = directory is None  # remove the directory on close if we made it
+        self.directory = directory if directory is not None else tempfile.mkdtemp(prefix='spacyjsonnlp-')
+        self._file = None
+        self._name = None
+        self._end = 0  # where the next result goes
+        self._size = 0  # size of the file, zeros past _end
+        self._maps = {}
+
+    def write(self, data: bytes) -> Handle:
+        if self._file is None:
+            self._name = f'{os.getpid()}.spool'
+            fd = os.open(os.path.join(self.directory, self._name), os.O_RDWR | os.O_CREAT)
+            self._file = os.fdopen(fd, 'r+b')
+            self._end = self._size = os.fstat(fd).st_size
+        offset = self._end
+        if offset + len(data) > self._size:
+            self._size = max(2 * self._size, SPOOL_SIZE, offset + len(data))
+            os.ftruncate(self._file.fileno(), self._size)
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        self._end += len(data)
+        return self._name, offset, len(data)
+
+    def read(self, handle: Handle) -> memoryview:
+        """A view of the result, valid as long as it is referenced, copy it with bytes() to keep it past close"""
+        name, offset, length = handle
+        m = self._maps.get(name)
+        if m is None or len(m) < offset + length:
+            # the file doubled since we mapped it, views of the old map keep it alive
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                m = self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(m)[offset:offset + length]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for m in self._maps.values():
+            try:
+                m.close()
+            except BufferError:
+                pass  # views are still out there, the map is released with the last of them
+        self._maps.clear()
+        if self.owner:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_spool: Spool = None
+_options: dict = {}
+
+
+def _init_worker(directory: str, options: dict) -> None:
+    global _spool, _options
+    _spool = Spool(directory)
+    _options = options
+
+
+def _work(text: str) -> Handle:
+    return _spool.write(json.dumps(SpacyPipeline.process(text, **_options)).encode('utf-8'))
+
+
+def process_parallel(texts: Iterable[str], n_process=2, chunksize=1, spool_dir: str = None, **options) -> Iterator[memoryview]:
+    """
+    Process texts in n_process worker processes with SpacyPipeline.process(text, **options), yielding the UTF-8
+    encoded JSON of each result in the original order. The views are only valid until the generator finishes.
+    """
+    with Spool(spool_dir) as spool:
+        with multiprocessing.Pool(n_process, _init_worker, (spool.directory, options)) as pool:
+            for handle in pool.imap(_work, texts, chunksize):
+                yield spool.read(handle)
+
+
+def write_parallel(texts: Iterable[str], out: BinaryIO, n_process=2, chunksize=1, spool_dir: str = None,
+                   **options) -> int:
+    """Write the results of process_parallel to out as newline-delimited JSON, returns the number of documents"""
+    n = 0
+    for data in process_parallel(texts, n_process, chunksize, spool_dir, **options):
+        out.write(data)
+        out.write(b'\n')
+        n += 1
+    return n
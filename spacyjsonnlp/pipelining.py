@@ -0,0 +1,129 @@
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+Pipelined batch processing: tokenization, model inference and JSON-NLP building run in their own threads, connected
+by bounded queues, so the model is not left idle while Python builds the output of the previous document.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import json
+import queue
+import threading
+from collections import deque
+from typing import Iterable, Iterator
+
+from spacyjsonnlp import build_json, load_model, resolve_fields
+
+POLL_SECONDS = 0.1  # how often a blocked stage checks whether it was cancelled
+_DONE = object()  # end of stream marker
+
+
+class _Failure(object):
+    """An exception raised in a stage, passed downstream to the consumer"""
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _drain(q: queue.Queue, stop: threading.Event, texts: deque) -> Iterator:
+    """Yield docs from q until the end of the stream, remembering their texts; failures are raised"""
+    while True:
+        item = _get(q, stop)
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        text, doc = item
+        texts.append(text)
+        yield doc
+
+
+def _stage(target, outbox: queue.Queue, stop: threading.Event) -> threading.Thread:
+    """Run target in a thread, then mark the end of its output or pass on its failure"""
+    def run():
+        try:
+            target()
+            _put(outbox, _DONE, stop)
+        except Exception as e:
+            _put(outbox, _Failure(e), stop)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def pipelined(texts: Iterable[str], spacy_model='en_core_web_sm', coreferences=False, constituents=False,
+              dependencies=True, expressions=True, fields=None, serialize=False, queue_size=8,
+              batch_size=8) -> Iterator:
+    """
+    Process texts with a single model, yielding one JSON-NLP object per text in the original order, or its JSON
+    string if serialize is set. At most queue_size documents wait between two stages. Closing the generator
+    cancels the stages, which stop at their next queue operation.
+    """
+    if spacy_model == 'auto':
+        raise ValueError('Pipelined processing needs a single model, use SpacyPipeline.process_batch to route by language')
+    fields = resolve_fields(fields)
+    nlp = load_model(spacy_model, coreferences, constituents)
+    tokenized, parsed, built = queue.Queue(queue_size), queue.Queue(queue_size), queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def tokenize():
+        for text in texts:
+            if not _put(tokenized, (text, nlp.tokenizer(text)), stop):
+                return
+
+    def infer():
+        pending = deque()  # texts of the docs inside the model pipes, in order
+        docs = _drain(tokenized, stop, pending)
+        for name, proc in nlp.pipeline:
+            docs = proc.pipe(docs, batch_size=batch_size) if hasattr(proc, 'pipe') else map(proc, docs)
+        for doc in docs:
+            if not _put(parsed, (pending.popleft(), doc), stop):
+                return
+
+    def build():
+        while True:
+            item = _get(parsed, stop)
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            text, doc = item
+            j = build_json(text, doc, nlp, spacy_model, coreferences, constituents, dependencies, expressions, fields)
+            if not _put(built, json.dumps(j) if serialize else j, stop):
+                return
+
+    _stage(tokenize, tokenized, stop)
+    _stage(infer, parsed, stop)
+    _stage(build, built, stop)
+    try:
+        while True:
+            item = built.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
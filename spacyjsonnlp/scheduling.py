@@ -0,0 +1,128 @@
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+Admission control and shortest-job-first scheduling for the microservice.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+# relative cost per character of the optional components, the tagger/parser/ner pipeline counts as 1
+COREF_COST = 3
+CONSTITUENTS_COST = 7
+
+
+class Overloaded(Exception):
+    """A request that cannot be admitted, status is the HTTP status to answer with"""
+    def __init__(self, message: str, status: int = 503, retry_after: int = 1):
+        super(Overloaded, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def estimate_cost(text: str, coreferences=False, constituents=False) -> int:
+    """Estimate the cost of processing text from its length and the requested components"""
+    weight = 1
+    if coreferences:
+        weight += COREF_COST
+    if constituents:
+        weight += CONSTITUENTS_COST
+    return len(text) * weight
+
+
+class Scheduler(object):
+    """
+    Admits requests while their total estimated cost stays within max_in_flight, and lets the cheapest waiting
+    request go first. A waiting request counts as aging cost units cheaper for every second it has waited, so long
+    requests are not starved by a steady stream of short ones. By default aging is derived from the limits, so that
+    the costliest request allowed overtakes a new request of no cost after half of max_wait, see current_aging.
+    Requests longer than max_chars are rejected outright,
+    and requests that find max_queued others waiting, or that wait longer than max_wait seconds, are turned away with
+    a Retry-After hint.
+    """
+    def __init__(self, max_chars=100000, max_in_flight=400000, max_queued=64, max_wait=30.0, retry_after=1,
+                 aging=None):
+        self.max_chars = max_chars
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.aging = aging  # None derives it from max_chars and max_wait
+
+        self.in_flight = 0
+        self._waiting = []  # heap of (priority, ticket, cost)
+        self._tickets = itertools.count()
+        self._ready = threading.Condition()
+
+    def _fits(self, cost: int) -> bool:
+        # a request bigger than the whole budget may still run on its own
+        return self.in_flight == 0 or self.in_flight + cost <= self.max_in_flight
+
+    @property
+    def current_aging(self) -> float:
+        """The cost units a waiting request gains per second, aging or the rate derived from the limits"""
+        if self.aging is not None:
+            return self.aging
+        return 2 * estimate_cost('a' * self.max_chars, coreferences=True, constituents=True) / self.max_wait
+
+    def check(self, text: str) -> None:
+        """Reject a text that is too long to ever be admitted"""
+        if len(text) > self.max_chars:
+            raise Overloaded(f'Text is longer than {self.max_chars} characters', status=413)
+
+    def acquire(self, text: str, coreferences=False, constituents=False) -> int:
+        """Block until the request may run, returns the cost to release afterwards"""
+        return self.acquire_batch([text], coreferences, constituents)
+
+    def acquire_batch(self, texts: List[str], coreferences=False, constituents=False) -> int:
+        """Like acquire, for a batch of texts that runs as a single request"""
+        for text in texts:
+            self.check(text)
+        cost = sum(estimate_cost(text, coreferences, constituents) for text in texts)
+        with self._ready:
+            if len(self._waiting) >= self.max_queued:
+                raise Overloaded('Too many requests are waiting', status=429, retry_after=self.retry_after)
+            # aging every waiting entry at the same rate keeps their order, so it is enough to age by arrival time
+            now = time.monotonic()
+            entry = (cost + self.current_aging * now, next(self._tickets), cost)
+            heapq.heappush(self._waiting, entry)
+            deadline = now + self.max_wait
+            while self._waiting[0] is not entry or not self._fits(cost):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._ready.notify_all()
+                    raise Overloaded('Timed out waiting for capacity', status=503, retry_after=self.retry_after)
+                self._ready.wait(remaining)
+            heapq.heappop(self._waiting)
+            self.in_flight += cost
+            self._ready.notify_all()  # the next in line may fit as well
+        return cost
+
+    def release(self, cost: int) -> None:
+        with self._ready:
+            self.in_flight -= cost
+            self._ready.notify_all()
+
+    @contextmanager
+    def admit(self, text: str, coreferences=False, constituents=False):
+        """Run the body of the with statement once the request is admitted"""
+        with self.admit_batch([text], coreferences, constituents) as cost:
+            yield cost
+
+    @contextmanager
+    def admit_batch(self, texts: List[str], coreferences=False, constituents=False):
+        cost = self.acquire_batch(texts, coreferences, constituents)
+        try:
+            yield cost
+        finally:
+            self.release(cost)
@@ -0,0 +1,78 @@
+"""
+(C) 2019 Damir Cavar, Oren Baldinger, Maanvitha Gongalla, Anurag Kumar, Murali Kammili, Boli Fang
+
+A bounded cache of sentence analyses, for corpora that repeat the same sentences over and over.
+
+Licensed under the Apache License 2.0, see the file LICENSE for more details.
+
+Brought to you by the NLP-Lab.org (https://nlp-lab.org/)!
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class SentenceCache(object):
+    """
+    A thread-safe LRU cache holding at most max_entries sentence analyses, for sentences of at most
+    max_chars_per_entry characters and max_chars characters in total, with hit and eviction counts.
+    """
+    def __init__(self, max_entries=10000, max_chars=1000000, max_chars_per_entry=1000):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.max_chars_per_entry = max_chars_per_entry
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: dict, size: int) -> None:
+        """Cache value for a sentence of size characters, sentences that are too long are not cached"""
+        if size > self.max_chars_per_entry:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.chars -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.chars += size
+            while len(self._entries) > self.max_entries or self.chars > self.max_chars:
+                self.chars -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.chars = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'maxEntries': self.max_entries,
+            'chars': self.chars,
+            'maxChars': self.max_chars,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': self.hit_rate,
+        }
@@ -1,8 +1,124 @@
 #!/usr/bin/env python3
-from spacyjsonnlp import SpacyPipeline
+import itertools
+import json
+import logging
+from collections import OrderedDict
+from typing import Iterator, Tuple
+
+from flask import Response, current_app, request, stream_with_context
+from spacyjsonnlp import SpacyPipeline, model_memory_report, reset_grown_models
+from spacyjsonnlp.scheduling import Overloaded, Scheduler
+from spacyjsonnlp.sentence_cache import SentenceCache
+from pyjsonnlp.microservices import Process
 from pyjsonnlp.microservices.flask_server import FlaskMicroservice
+from pyjsonnlp.pipeline import Pipeline
+
+logger = logging.getLogger(__name__)
+
+# request parameters passed on to SpacyPipeline.process_batch by the bulk endpoint
+BULK_OPTIONS = ('spacy_model', 'coreferences', 'constituents', 'dependencies', 'expressions', 'fields')
+
+
+class SpacyMicroservice(FlaskMicroservice):
+    """A FlaskMicroservice that runs every request through a Scheduler, and optionally a SentenceCache"""
+    def __init__(self, import_name, pipeline: Pipeline, base_route='/', scheduler: Scheduler = None,
+                 sentence_cache: SentenceCache = None):
+        super(SpacyMicroservice, self).__init__(import_name, pipeline, base_route)
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.sentence_cache = sentence_cache
+        self.max_string_growth = None  # reset models whose StringStore grew by more strings than this
+        self.bulk_batch_size = 16  # documents admitted and parsed together by the bulk endpoint
+
+        self.add_url_rule(base_route + 'memory', view_func=self.memory, methods=['GET'])
+        self.add_url_rule(base_route + 'bulk', view_func=self.bulk, methods=['POST'])
+
+    def run_pipeline(self, style: Process) -> OrderedDict:
+        params = self.make_pipeline_args(style)
+        if self.sentence_cache is not None:
+            params['sentence_cache'] = self.sentence_cache
+        with self.scheduler.admit(params['text'], params.get('coreferences', False), params.get('constituents', False)):
+            j = self.pipeline.process(**params)
+        if self.max_string_growth is not None:
+            reset_grown_models(self.max_string_growth)
+        return j
+
+    def memory(self):
+        try:
+            report = model_memory_report()
+            if self.sentence_cache is not None:
+                report['sentenceCache'] = self.sentence_cache.stats()
+            return self.write_json(report)
+        except Exception as e:
+            return self.handle_error(e)
+
+    def bulk(self):
+        """Process a newline-delimited JSON body of documents, streaming back one JSON-NLP object per line"""
+        try:
+            args = self.get_args()
+            options = dict((k, args[k]) for k in BULK_OPTIONS if k in args)
+            return Response(stream_with_context(self.stream_bulk(request.stream, options)), mimetype='application/x-ndjson')
+        except Exception as e:
+            return self.handle_error(e)
+
+    def read_bulk(self, stream) -> Iterator[Tuple[int, object]]:
+        """
+        Yield the line index and text of each document in stream, or the line index and an exception for a line that
+        is not valid JSON, has no text, or is too long to be admitted. Empty lines are skipped.
+        """
+        for i, line in enumerate(stream):
+            if not line.strip():
+                continue
+            try:
+                doc = json.loads(line.decode('utf-8'))
+                text = doc.get('text') if isinstance(doc, dict) else doc
+                if not isinstance(text, str):
+                    raise ValueError('A document must be a JSON string or an object with a text field')
+                self.scheduler.check(text)
+                yield i, text
+            except Exception as e:
+                yield i, e
+
+    def stream_bulk(self, stream, options: dict) -> Iterator[str]:
+        """
+        Read documents from stream, one JSON object with a text field (or a JSON string) per line, and yield their
+        JSON-NLP, in order. Documents are admitted and parsed in batches of bulk_batch_size, so a client that goes
+        away stops the processing at the next batch. A line that cannot be processed yields an object with the error
+        and the index of the line instead, and the stream goes on.
+        """
+        def error(i: int, e: Exception) -> str:
+            return json.dumps({'error': str(e), 'line': i}) + '\n'
+
+        docs = self.read_bulk(stream)
+        coreferences, constituents = options.get('coreferences', False), options.get('constituents', False)
+        while True:
+            batch = list(itertools.islice(docs, self.bulk_batch_size))
+            if not batch:
+                return
+            valid = [(i, text) for i, text in batch if isinstance(text, str)]
+            try:
+                texts = [text for i, text in valid]
+                with self.scheduler.admit_batch(texts, coreferences, constituents):
+                    results = iter(self.pipeline.process_batch(texts, batch_size=len(texts),
+                                                               sentence_cache=self.sentence_cache, **options))
+                if self.max_string_growth is not None:
+                    reset_grown_models(self.max_string_growth)
+            except Exception as e:
+                logger.exception(e)
+                for i, text in batch:
+                    yield error(i, e if isinstance(text, str) else text)
+                continue
+            for i, text in batch:
+                yield json.dumps(next(results)) + '\n' if isinstance(text, str) else error(i, text)
+
+    def handle_error(self, error: Exception):
+        if isinstance(error, Overloaded):
+            headers = {'Retry-After': str(error.retry_after)} if error.status in (429, 503) else {}
+            return Response(json.dumps({'error': str(error)}), mimetype=current_app.config['JSONIFY_MIMETYPE'],
+                            status=error.status, headers=headers)
+        return super(SpacyMicroservice, self).handle_error(error)
+
 
-app = FlaskMicroservice(__name__, SpacyPipeline(), base_route='/')
+app = SpacyMicroservice(__name__, SpacyPipeline(), base_route='/')
 app.with_constituents = True
 app.with_coreferences = True
 app.with_dependencies = True
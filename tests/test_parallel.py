@@ -0,0 +1,37 @@
+import io
+import json
+from unittest import TestCase
+
+from spacyjsonnlp import SpacyPipeline
+from spacyjsonnlp.parallel import Spool, process_parallel, write_parallel
+
+texts = ["Autonomous cars from the countryside of France shift insurance liability toward manufacturers.",
+         "People are afraid that they will crash.", "I am a cat."]
+
+
+class TestSpool(TestCase):
+    def test_write_read(self):
+        with Spool() as spool:
+            handles = [spool.write(b'{"a": 1}'), spool.write(b'{"b": 22}')]
+            assert b'{"a": 1}' == bytes(spool.read(handles[0]))
+            handles.append(spool.write(b'{"c": 333}'))  # grows the file after it was mapped
+            assert [b'{"a": 1}', b'{"b": 22}', b'{"c": 333}'] == [bytes(spool.read(h)) for h in handles]
+
+    def test_shared_maps(self):
+        with Spool() as spool:
+            views = [spool.read(spool.write(b'x' * 1000 + str(i).encode('ascii'))) for i in range(5000)]
+            assert [b'x' * 1000 + str(i).encode('ascii') for i in range(5000)] == [bytes(v) for v in views]
+            assert len(set(id(v.obj) for v in views)) <= 4  # one map per doubling of the file
+            del views
+
+
+class TestParallel(TestCase):
+    def test_process_parallel(self):
+        actual = [json.loads(bytes(data).decode('utf-8')) for data in process_parallel(texts, n_process=2, spacy_model='en')]
+        expected = [json.loads(json.dumps(SpacyPipeline.process(t, spacy_model='en'))) for t in texts]
+        assert [j['documents'] for j in expected] == [j['documents'] for j in actual]
+
+    def test_write_parallel(self):
+        out = io.BytesIO()
+        assert 3 == write_parallel(texts, out, n_process=2, spacy_model='en')
+        assert texts == [json.loads(line)['documents'][0]['text'] for line in out.getvalue().splitlines()]
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+import pytest
+
+from spacyjsonnlp import SpacyPipeline
+from spacyjsonnlp.pipelining import pipelined
+
+texts = ["Autonomous cars from the countryside of France shift insurance liability toward manufacturers.",
+         "People are afraid that they will crash.", "I am a cat."]
+
+
+class TestPipelined(TestCase):
+    def test_pipelined(self):
+        actual = list(pipelined(texts, spacy_model='en', queue_size=1, batch_size=2))
+        expected = [SpacyPipeline.process(t, spacy_model='en') for t in texts]
+        assert [j['documents'] for j in expected] == [j['documents'] for j in actual]
+
+    def test_serialize(self):
+        actual = list(pipelined(texts, spacy_model='en', serialize=True))
+        assert 3 == len(actual) and all(isinstance(j, str) for j in actual)
+
+    def test_auto(self):
+        with pytest.raises(ValueError):
+            next(pipelined(texts, spacy_model='auto'))
@@ -0,0 +1,93 @@
+import threading
+import time
+from unittest import TestCase
+
+import pytest
+
+from spacyjsonnlp.scheduling import Overloaded, Scheduler, estimate_cost
+
+
+class TestScheduler(TestCase):
+    def test_estimate_cost(self):
+        assert 10 == estimate_cost('a' * 10)
+        assert estimate_cost('a' * 10) < estimate_cost('a' * 10, coreferences=True) < \
+            estimate_cost('a' * 10, coreferences=True, constituents=True)
+
+    def test_too_long(self):
+        s = Scheduler(max_chars=5)
+        with pytest.raises(Overloaded) as e:
+            s.acquire('a' * 6)
+        assert 413 == e.value.status
+
+    def test_batch(self):
+        s = Scheduler(max_chars=5)
+        with s.admit_batch(['abc', 'de']) as cost:
+            assert 5 == cost == s.in_flight
+        assert 0 == s.in_flight
+        with pytest.raises(Overloaded):
+            s.acquire_batch(['abc', 'abcdef'])
+
+    def test_queue_full(self):
+        s = Scheduler(max_queued=0)
+        with pytest.raises(Overloaded) as e:
+            s.acquire('a')
+        assert 429 == e.value.status
+
+    def test_timeout(self):
+        s = Scheduler(max_in_flight=10, max_wait=0.05, retry_after=7)
+        with s.admit('a' * 10):
+            with pytest.raises(Overloaded) as e:
+                s.acquire('a')
+        assert 503 == e.value.status and 7 == e.value.retry_after
+        assert 0 == s.in_flight and not s._waiting
+
+    def admission_order(self, s, lengths):
+        """Queue requests of the given lengths in order behind a full budget, returns the order they ran in"""
+        order = []
+
+        def run(text):
+            with s.admit(text):
+                order.append(len(text))
+
+        cost = s.acquire('a' * s.max_in_flight)  # fill the budget so the others have to queue
+        threads = []
+        for n in lengths:
+            threads.append(threading.Thread(target=run, args=('a' * n,)))
+            threads[-1].start()
+            deadline = time.monotonic() + 5
+            while len(s._waiting) < len(threads) and time.monotonic() < deadline:
+                time.sleep(0.001)
+        s.release(cost)
+        for t in threads:
+            t.join()
+        return order
+
+    def test_shortest_first(self):
+        # no two of these fit within the budget together, so they run one at a time
+        assert [6, 7, 8] == self.admission_order(Scheduler(max_in_flight=10, aging=0), (8, 6, 7))
+
+    def test_aging(self):
+        # aged by so much per second, the requests that waited longest go first
+        assert [8, 6, 7] == self.admission_order(Scheduler(max_in_flight=10, aging=10 ** 9), (8, 6, 7))
+
+    def test_default_aging(self):
+        # the longest text allowed, with coreferences and constituents, gets through a steady stream of short ones
+        s = Scheduler(max_wait=0.5)
+        stop = threading.Event()
+
+        def short():
+            while not stop.is_set():
+                with s.admit('a' * 1000, coreferences=True, constituents=True):
+                    time.sleep(0.002)
+
+        threads = [threading.Thread(target=short) for _ in range(8)]
+        for t in threads:
+            t.start()
+        try:
+            time.sleep(0.05)
+            with s.admit('a' * s.max_chars, coreferences=True, constituents=True):
+                pass
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
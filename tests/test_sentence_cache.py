@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from spacyjsonnlp.sentence_cache import SentenceCache
+
+
+class TestSentenceCache(TestCase):
+    def test_lru(self):
+        c = SentenceCache(max_entries=2)
+        c.put('a', {'a': 1}, 1)
+        c.put('b', {'b': 2}, 1)
+        assert {'a': 1} == c.get('a')
+        c.put('c', {'c': 3}, 1)  # evicts b, the least recently used
+        assert c.get('b') is None
+        assert 2 == len(c) and 1 == c.evictions
+
+    def test_chars(self):
+        c = SentenceCache(max_chars=10, max_chars_per_entry=6)
+        c.put('long', {}, 7)  # too long to cache
+        assert c.get('long') is None and 0 == c.chars
+        c.put('a', {}, 6)
+        c.put('b', {}, 5)  # evicts a to stay within 10 characters
+        assert c.get('a') is None and 5 == c.chars and 1 == c.evictions
+        c.put('b', {}, 3)
+        assert 3 == c.chars
+
+    def test_stats(self):
+        c = SentenceCache()
+        assert 0.0 == c.hit_rate
+        c.put('a', {}, 1)
+        c.get('a')
+        c.get('b')
+        assert 0.5 == c.hit_rate
+        assert {'entries': 1, 'maxEntries': 10000, 'chars': 1, 'maxChars': 1000000, 'hits': 1, 'misses': 1,
+                'evictions': 0, 'hitRate': 0.5} == c.stats()
@@ -0,0 +1,44 @@
+import json
+from unittest import TestCase
+
+from spacyjsonnlp import SpacyPipeline
+from spacyjsonnlp.scheduling import Scheduler
+from spacyjsonnlp.server import SpacyMicroservice
+
+texts = ["Autonomous cars shift insurance liability toward manufacturers.", "People are afraid that they will crash.",
+         "I am a cat."]
+
+
+class TestBulk(TestCase):
+    def setUp(self):
+        self.app = SpacyMicroservice(__name__, SpacyPipeline(), scheduler=Scheduler(max_chars=50))
+        self.app.bulk_batch_size = 2
+
+    def post(self, lines):
+        r = self.app.test_client().post('/bulk?spacy_model=en', data='\n'.join(lines) + '\n',
+                                        content_type='application/x-ndjson')
+        assert 200 == r.status_code
+        return [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+
+    def test_order(self):
+        actual = self.post([json.dumps(texts[1]), json.dumps({'text': texts[2]}), '', json.dumps({'text': texts[1]})])
+        assert [texts[1], texts[2], texts[1]] == [j['documents'][0]['text'] for j in actual]
+
+    def test_invalid_line(self):
+        actual = self.post([json.dumps(texts[1]), json.dumps(texts[2]), '{"text": ', json.dumps(texts[2])])
+        assert 4 == len(actual)
+        assert [texts[1], texts[2], texts[2]] == [j['documents'][0]['text'] for j in actual[:2] + actual[3:]]
+        assert 2 == actual[2]['line'] and 'error' in actual[2]
+
+    def test_too_long(self):
+        actual = self.post([json.dumps(texts[1]), json.dumps(texts[0])])
+        assert texts[1] == actual[0]['documents'][0]['text']
+        assert {'error': 'Text is longer than 50 characters', 'line': 1} == actual[1]
+
+    def test_errors_within_batch(self):
+        self.app.bulk_batch_size = 4
+        actual = self.post([json.dumps(texts[2]), json.dumps(texts[0]), json.dumps({'x': 1}), json.dumps(texts[1]),
+                            json.dumps(texts[2])])
+        assert 5 == len(actual)
+        assert [texts[2], texts[1], texts[2]] == [actual[i]['documents'][0]['text'] for i in (0, 3, 4)]
+        assert [1, 2] == [actual[i]['line'] for i in (1, 2)]
@@ -5,7 +5,9 @@ import pyjsonnlp
 import pytest
 from pyjsonnlp import validation
 
-from spacyjsonnlp import SpacyPipeline, get_model
+from spacyjsonnlp import SpacyPipeline, get_model, detect_language, route_model, resolve_fields, model_memory_report, \
+    reset_model
+from spacyjsonnlp.sentence_cache import SentenceCache
 from . import mocks
 
 text = "Autonomous cars from the countryside of France shift insurance liability toward manufacturers. People are afraid that they will crash."
@@ -42,3 +44,73 @@ class TestSpacy(TestCase):
 
     def test_validation(self):
         assert validation.is_valid(SpacyPipeline.process(text, spacy_model='en', coreferences=True))
+
+    def test_detect_language(self):
+        assert 'en' == detect_language(text)
+        assert 'de' == detect_language('Der Hund ist nicht in dem Haus und die Katze auch nicht.')
+        assert 'en' == detect_language('I am a cat.')
+        assert 'en' == detect_language('Apple buys the startup in London.')
+        assert 'es' == detect_language('El niño come una manzana en la escuela.')
+        assert 'pt' == detect_language('O menino comeu a maçã e o bolo na escola.')
+        assert 'fr' == detect_language('Le garçon mange une pomme dans la cuisine.')
+        assert 'it' == detect_language('Il ragazzo mangia la mela e beve il latte.')
+        assert 'it' == detect_language('Ciao a tutti, come state?')
+        assert 'nl' == detect_language('De jongen eet een appel in de keuken.')
+        assert 'xx' == detect_language('12345')
+        assert 'xx' == detect_language('in')  # shared by en, it and nl
+        assert 'xx_ent_wiki_sm' == route_model('12345')
+
+    def test_process_batch(self):
+        texts = [text, 'Der Hund ist nicht in dem Haus und die Katze auch nicht.', 'Paris. London 2019.', 'I am a cat.']
+        actual = SpacyPipeline.process_batch(texts, coreferences=False, constituents=False)
+        assert texts == [j['documents'][0]['text'] for j in actual]
+        assert ['en', 'de', 'xx', 'en'] == [j['documents'][0]['meta']['DC.language'] for j in actual]
+        # the fallback model has no parser, so sentences come from the sentencizer and there are no dependencies
+        assert 2 == len(actual[2]['documents'][0]['sentences'])
+        assert 'dependencies' not in actual[2]['documents'][0]
+
+    def test_resolve_fields(self):
+        assert frozenset(('lemma', 'xpos', 'upos')) == resolve_fields('pos')
+        assert frozenset(('upos',)) == resolve_fields('text, upos')
+        assert frozenset(('upos',)) == resolve_fields(['upos'])
+        with pytest.raises(ValueError):
+            resolve_fields('upos,color')
+
+    def test_process_fields(self):
+        actual = SpacyPipeline.process(text, spacy_model='en', fields='upos')
+        expected = {'id': 1, 'sentence_id': 1, 'text': 'Autonomous', 'upos': 'ADJ'}
+        assert expected == actual['documents'][0]['tokenList'][0], actual['documents'][0]['tokenList'][0]
+
+    def test_process_coref_window(self):
+        actual = SpacyPipeline.process(text, spacy_model='en', coreferences=True, coref_window=1, coref_overlap=0)
+        assert validation.is_valid(actual)
+        full = SpacyPipeline.process(text, spacy_model='en', coreferences=True)
+        # the only cluster is within the second sentence, so a one sentence window finds it as well
+        assert full['documents'][0]['coreferences'] == actual['documents'][0]['coreferences']
+
+    def test_process_sentence_cache(self):
+        cache = SentenceCache()
+        first = SpacyPipeline.process(text, spacy_model='en', sentence_cache=cache)
+        assert validation.is_valid(first)
+        assert 0 == cache.hits and 2 == cache.misses
+        second = SpacyPipeline.process('I am a cat. ' + text, spacy_model='en', sentence_cache=cache)
+        assert 2 == cache.hits
+        tokens = second['documents'][0]['tokenList']
+        assert 'Autonomous' == tokens[5]['text'] and 12 == tokens[5]['characterOffsetBegin']
+        assert [t['upos'] for t in first['documents'][0]['tokenList']] == [t['upos'] for t in tokens[5:]]
+
+    def test_process_batch_sentence_cache(self):
+        cache = SentenceCache()
+        actual = SpacyPipeline.process_batch([text, 'I am a cat. ' + text], spacy_model='en', sentence_cache=cache)
+        assert 2 == cache.hits and 3 == cache.misses
+        assert SpacyPipeline.process(text, spacy_model='en', sentence_cache=cache)['documents'] == actual[0]['documents']
+
+    def test_shared_vocab(self):
+        assert get_model('en', True, False).vocab is get_model('en', False, False).vocab
+
+    def test_memory_report(self):
+        SpacyPipeline.process('Zyxwvut qwertyuiop.', spacy_model='en')
+        report = model_memory_report()['models']['en_core_web_sm']
+        assert report['stringGrowth'] > 0 and report['strings'] > report['stringGrowth']
+        reset_model('en')
+        assert 'en_core_web_sm' not in model_memory_report()['models']